@@ -11,12 +11,11 @@ The devices table has three columns: id, name, and vendor.
 
 The module contains the following functions:
 - get_ids: Get the USB IDs from the server.
-- parse_data: Parse the USB IDs data into a DataFrame.
-- format_data: Format the data into a list of tuples.
+- parse_data: Parse the USB IDs data into batches of vendor and device rows.
 - update_db: Update the database with the new data.
 - main: Update the database with the latest USB IDs data.
 
-The module also contains two classes:
+The module also contains two namedtuples:
 - Vendor: Represents a vendor with an ID and a name.
 - Device: Represents a device with an ID, a name, and a vendor ID.
 
@@ -30,107 +29,107 @@ Author:
     JCStaples
 """
 
-import requests, pandas as pd, sqlite3 as sql
+import os, queue, threading, requests, sqlite3 as sql
+from collections import namedtuple
 
 
 IDS_DB = 'usb_ids.db'
+IDS_ETAG = 'usb_ids.etag'
 
 
-class Vendor:
-    """
-    Represents a vendor with an ID and a name.
-
-    :param id: The vendor ID.
-    :param name: The vendor name.
-    """
-
-    def __init__(self, id, name):
-        self.id = id
-        self.name = name
-
-
-class Device:
-    """
-    Represents a device with an ID, a name, and a vendor ID.
-
-    :param device_id: The device ID.
-    :param device_name: The device name.
-    :param vendor: The vendor ID.
-    """
-
-    def __init__(self, device_id, device_name, vendor=None):
-        self.vendor = vendor
-        self.id = device_id
-        self.name = device_name
+# Immutable data carriers: namedtuples avoid the per-instance __dict__
+# a regular class would allocate for every row
+Vendor = namedtuple('Vendor', ['id', 'name'])
+Device = namedtuple('Device', ['id', 'name', 'vendor'], defaults=[None])
 
 
 def get_ids():
     """
     Get the USB IDs from the server.
 
-    :return: The response from the server.
+    Sends the ETag/Last-Modified headers saved from the previous update
+    so the server can answer 304 Not Modified instead of resending the
+    full file.
+
+    :return: The response from the server, or None if the server
+        reported the file is unchanged (no update needed).
     """
 
     url = 'http://www.linux-usb.org/usb.ids'
-    response = requests.get(url)
-    if response.status_code == 200:
-        return response
-    else:
-        return
-
 
-def parse_data(data):
+    # Only ask for a conditional response if the database is actually
+    # there to serve the cached copy
+    headers = {}
+    if os.path.exists(IDS_DB) and os.path.exists(IDS_ETAG):
+        try:
+            with open(IDS_ETAG) as f:
+                etag, last_modified = f.read().split('\n')[:2]
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+        except (OSError, ValueError):
+            pass
+
+    # Stream the body so parsing can start while the download is still
+    # in flight, instead of decoding the whole file into one string
+    response = requests.get(url, stream=True, timeout=30, headers=headers)
+    if response.status_code == 304:
+        return None
+    return response
+
+
+def parse_data(lines, batch_size=2000):
     """
-    Parse the USB IDs data into a DataFrame.
+    Parse the USB IDs data into batches of vendor and device rows.
 
-    :param data: The USB IDs data.
+    :param lines: An iterable of lines of USB IDs data.
+    :param batch_size: The number of rows to collect before yielding a
+        batch.
 
-    :return: The parsed data as a DataFrame.
+    :return: A generator of (vendors, devices) pairs of row-tuple lists,
+        ready to insert into the database.
     """
 
-    lines = data.split('\n')
-    parsed_data = []
+    vendors = []
+    devices = []
     current_vendor_id = None
-    current_vendor_name = None
+    sentinel = '# List of known device classes'
 
+    # Dispatch on the first character: comment, device (tab-indented) or
+    # vendor line
     for line in lines:
-        if line.strip() == '# List of known device classes, subclasses and protocols':
-            break
-        elif line.startswith('#') or line.strip() == '':
+        char = line[:1]
+        if char == '':
             continue
-        elif not line.startswith('\t'):
-            current_vendor_id, current_vendor_name = line.split('  ', 1)
+        elif char == '#':
+            if line.startswith(sentinel):
+                break
+            continue
+        elif char == '\t':
+            device_id, _, device_name = line.strip().partition('  ')
+            devices.append((int(device_id, 16), device_name, current_vendor_id))
         else:
-            device_id, device_name = line.strip().split('  ', 1)
-            parsed_data.append([current_vendor_id, current_vendor_name, device_id, device_name])
-
-    df = pd.DataFrame(parsed_data, columns=['Vendor ID', 'Vendor Name', 'Device ID', 'Device Name'])
-    return df
+            vendor_id, _, vendor_name = line.partition('  ')
+            current_vendor_id = int(vendor_id, 16)
+            vendors.append((current_vendor_id, vendor_name))
 
+        if len(vendors) + len(devices) >= batch_size:
+            yield vendors, devices
+            vendors = []
+            devices = []
 
-def format_data(df):
-    """
-    Format the data into a list of tuples.
-
-    :param df: The DataFrame of the USB IDs data.
-
-    :return: The formatted data as a list of tuples.
-    """
-
-    data = []
-    for index, row in df.iterrows():
-        vendor = Vendor(row['Vendor ID'], row['Vendor Name'])
-        device = Device(row['Device ID'], row['Device Name'], vendor.id)
-        data.append((vendor, device))
-    return data
+    if vendors or devices:
+        yield vendors, devices
 
 
-def update_db(con, data):
+def update_db(con, batches):
     """
     Update the database with the new data.
 
     :param con: The database connection.
-    :param data: The new data to add to the database.
+    :param batches: An iterable of (vendors, devices) row-tuple batches,
+        as produced by parse_data.
 
     :return: True if the update was successful, False otherwise.
     """
@@ -139,24 +138,77 @@ def update_db(con, data):
         # Create cursor
         cursor = con.cursor()
 
-        # Drop tables if they exist
-        cursor.execute('DROP TABLE IF EXISTS vendors')
-        cursor.execute('DROP TABLE IF EXISTS devices')
-
-        # Create tables
-        cursor.execute('CREATE TABLE vendors (id TEXT, name TEXT)')
-        cursor.execute('CREATE TABLE devices (id TEXT, name TEXT, vendor TEXT)')
-
-        for vendor, device in data:
-            # Insert data
-            cursor.execute('INSERT INTO vendors VALUES (?, ?)', (vendor.id, vendor.name))
-            cursor.execute('INSERT INTO devices VALUES (?, ?, ?)', (device.id, device.name, vendor.id))
+        # Tune SQLite for a bulk load: WAL journal, no per-statement
+        # fsync, in-memory temp storage and a 64 MB page cache
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=OFF')
+        cursor.execute('PRAGMA temp_store=MEMORY')
+        cursor.execute('PRAGMA cache_size=-65536')
+
+        # Run the update as a single explicit transaction so the bulk
+        # load commits (and syncs to disk) exactly once
+        cursor.execute('BEGIN')
+
+        # Migrate databases built before the upsert schema: tables
+        # without primary keys are dropped once and recreated
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='vendors'")
+        schema = cursor.fetchone()
+        if schema and 'PRIMARY KEY' not in schema[0]:
+            cursor.execute('DROP TABLE vendors')
+            cursor.execute('DROP TABLE IF EXISTS devices')
+
+        # Create tables on first run (IDs are stored as integers, not
+        # hex strings, for smaller indexes and faster compares)
+        cursor.execute('CREATE TABLE IF NOT EXISTS vendors (id INTEGER PRIMARY KEY, name TEXT)')
+        cursor.execute('CREATE TABLE IF NOT EXISTS devices (id INTEGER, name TEXT, vendor INTEGER, '
+                       'PRIMARY KEY (id, vendor))')
+
+        # Upsert batch by batch as the parser produces them, so the write
+        # work overlaps parsing and scales with the delta between
+        # usb.ids revisions instead of the full corpus
+        seen_vendors = set()
+        seen_devices = set()
+        for vendors, devices in batches:
+            # Insert each vendor at most once per run, even if the feed
+            # repeats a vendor line
+            vendors = [row for row in vendors if row[0] not in seen_vendors]
+            cursor.executemany('INSERT INTO vendors (id, name) VALUES (?, ?) '
+                               'ON CONFLICT(id) DO UPDATE SET name = excluded.name', vendors)
+            cursor.executemany('INSERT INTO devices (id, name, vendor) VALUES (?, ?, ?) '
+                               'ON CONFLICT(id, vendor) DO UPDATE SET name = excluded.name', devices)
+            seen_vendors.update(row[0] for row in vendors)
+            seen_devices.update((row[0], row[2]) for row in devices)
+
+        # Remove rows that disappeared upstream
+        cursor.execute('SELECT id FROM vendors')
+        stale_vendors = {row[0] for row in cursor.fetchall()} - seen_vendors
+        cursor.executemany('DELETE FROM vendors WHERE id = ?', [(vid,) for vid in stale_vendors])
+
+        cursor.execute('SELECT id, vendor FROM devices')
+        stale_devices = set(cursor.fetchall()) - seen_devices
+        cursor.executemany('DELETE FROM devices WHERE id = ? AND vendor = ?', list(stale_devices))
+
+        # Index after the bulk load so reverse searches seek instead of
+        # scanning (the primary keys already index the other lookups)
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_devices_vendor ON devices(vendor)')
 
         con.commit()
         return True
     except Exception as e:
         print(f'An error occurred:\n{e}')
+        # Abandon the open transaction so the connection is usable again
+        try:
+            con.rollback()
+        except sql.Error:
+            pass
         return False
+    finally:
+        # Restore durable syncs for normal read use, whether or not the
+        # update succeeded
+        try:
+            con.execute('PRAGMA synchronous=NORMAL')
+        except sql.Error:
+            pass
 
 
 def main(con):
@@ -171,19 +223,69 @@ def main(con):
     updated = False
 
     if con is None:
-        con = sql.connect(IDS_DB)
+        # isolation_level=None leaves transaction control to the explicit
+        # BEGIN/COMMIT in update_db
+        con = sql.connect(IDS_DB, isolation_level=None)
 
     response = get_ids()
+    if response is None:
+        print('Database already up to date')
+        return True
+
     if response.status_code == 200:
-        df = parse_data(response.text)
-        data = format_data(df)
-        updated = update_db(con, data)
+        # Parse on a background thread and load on this one (sqlite3
+        # objects must stay on the thread that created them), handing
+        # batches over through a bounded queue
+        batch_queue = queue.Queue(maxsize=8)
+        errors = []
+        finished = []
+
+        def produce():
+            try:
+                for batch in parse_data(response.iter_lines(decode_unicode=True)):
+                    batch_queue.put(batch)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                batch_queue.put(None)
+
+        def batches():
+            while True:
+                batch = batch_queue.get()
+                if batch is None:
+                    finished.append(True)
+                    break
+                yield batch
+            if errors:
+                # Abort the update (and its transaction) rather than
+                # pruning rows the parser never got to
+                raise errors[0]
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        updated = update_db(con, batches())
+
+        # If update_db failed mid-stream it stopped consuming before the
+        # sentinel; keep draining so the producer is not left blocked on
+        # a full queue and join can return
+        if not finished:
+            while batch_queue.get() is not None:
+                pass
+        producer.join()
+
         if updated:
+            # Remember the validators so the next update can be answered
+            # with a cheap 304 instead of the full file
+            etag = response.headers.get('ETag', '')
+            last_modified = response.headers.get('Last-Modified', '')
+            if etag or last_modified:
+                with open(IDS_ETAG, 'w') as f:
+                    f.write(f'{etag}\n{last_modified}\n')
             print('Database updated successfully')
         else:
             print('Failed to update database')
 
     else:
         print('Failed to get data from server')
-    
+
     return updated
\ No newline at end of file
@@ -37,28 +37,79 @@ Author:
 """
 
 # Import libraries
-import sys, os, ids, sqlite3 as sql, argparse
+import sys, os, gzip, shutil, functools, ids, sqlite3 as sql, argparse
 
 
 # Define consants
 DEBUG = True
 IDS_DB = 'usb_ids.db'
 
+# Build the argument parser once at import rather than on every call
+_PARSER = argparse.ArgumentParser(description='USB Lookup Tool')
+_PARSER.add_argument('-u', action='store_true',
+                     help='Update the database with the latest vendor and device information. Usage: python usb-lookup.py -u')
+_PARSER.add_argument('-v', metavar='vendor_id',
+                     help='Perform a reverse search in the database using a vendor id. '
+                         'This will return the devices associated with the provided vendor. '
+                         'Usage: python usb-lookup.py -v "Vendor ID"')
+_PARSER.add_argument('-d', metavar='device_id',
+                     help='Search the database for a device using its ID. '
+                         'This will return the name and vendor associated with the provided ID. '
+                         'Usage: python usb-lookup.py -d "Device ID"')
+_PARSER.add_argument('-c', nargs=2, metavar=('vendor_id', 'device_id'),
+                     help='Perform a complete search in the database using a vendor ID and device ID. '
+                         'This will return the names associated with the provided IDs. '
+                         'Usage: python usb-lookup.py -c "Vendor ID" "Device ID"')
+_PARSER.add_argument('-i', action='store_true',
+                     help='Enter interactive mode. In this mode, the program will prompt you for input '
+                         'and perform searches based on your responses. '
+                         'Usage: python usb-lookup.py -i')
+
+
+# ANSI clear-screen-and-home sequence, precomputed so clear_screen can
+# write it directly instead of forking a shell for clear/cls
+_CLEAR = '\x1b[2J\x1b[H'
+
 
 # Utility
 def clear_screen():
     try:
         if DEBUG:
             return
-        
-        if sys.platform == 'win32':
+
+        if os.name == 'nt' and not (os.environ.get('WT_SESSION') or os.environ.get('ANSICON')):
+            # Legacy Windows consoles don't honor ANSI escape sequences
             os.system('cls')
         else:
-            os.system('clear')
+            sys.stdout.write(_CLEAR)
+            sys.stdout.flush()
     except Exception:
         return
 
 
+def _norm(id_string):
+    """
+    Normalize a user-supplied hex ID for database lookups.
+
+    Accepts surrounding whitespace, uppercase hex and an optional 0x
+    prefix, and rejects anything that is not a valid 16-bit ID before a
+    query ever runs.
+
+    Args:
+        id_string: The raw ID string from the command line or prompt.
+
+    Returns:
+        The ID as an integer.
+
+    Raises:
+        ValueError: If the input is not a valid ID.
+    """
+    value = int(id_string.strip(), 16)
+    if not 0 <= value <= 0xffff:
+        raise ValueError(f'ID out of range: {id_string}')
+    return value
+
+
 def prompt_continue():
     try:
         input('\nPress enter to continue...')
@@ -72,14 +123,49 @@ def prompt_continue():
 
 
 # Define Functions
+def restore_db():
+    """
+    Restore the database from a bundled usb_ids.db.gz snapshot.
+
+    Decompressing a prebuilt snapshot shipped next to the script is much
+    faster than the first-run download+parse+load, which stays as the
+    fallback (and as the explicit -u update path).
+
+    Returns:
+        True if a snapshot was found and restored, False otherwise.
+    """
+    seed = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'usb_ids.db.gz')
+    if not os.path.exists(seed):
+        return False
+
+    try:
+        print('Restoring bundled database snapshot...')
+        with gzip.open(seed, 'rb') as src, open(IDS_DB, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        return True
+    except (OSError, gzip.BadGzipFile) as e:
+        print(f'An error occurred:\n{e}')
+        return False
+
+
 def check_db(con):
-    cursor = con.cursor()
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='vendors'")
-    db_exists = cursor.fetchone()
-    if db_exists:
+    # Same probe ids.update_db uses for its schema migration: a vendors
+    # table without primary keys predates the integer-ID schema, and
+    # integer lookups would silently miss its TEXT rows
+    schema = con.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='vendors'").fetchone()
+    if schema and 'PRIMARY KEY' in schema[0]:
         return True
-    
-    print('Database not found! Updating...')
+
+    if schema:
+        print('Database schema is out of date! Updating...')
+    else:
+        print('Database not found! Updating...')
+    # A leftover validator sidecar would let the server answer 304 and
+    # skip the load even though this database needs a rebuild (connecting
+    # creates the file, so the exists-check in get_ids passes); drop it
+    # so the full file is fetched
+    if os.path.exists(ids.IDS_ETAG):
+        os.remove(ids.IDS_ETAG)
     updated = ids.main(con)
     if updated:
         print('Database updated!')
@@ -95,46 +181,30 @@ def search_vendor(con, vendor_id):
 
     Args:
         con: A sqlite3 connection object.
-        vendor_id: The vendor ID to search for.
+        vendor_id: The vendor ID to search for, as a normalized integer
+            (see _norm).
 
     Returns:
         A Vendor object if the vendor is found, None otherwise.
     """
     try:
-        cursor = con.cursor()
-        cursor.execute('SELECT * FROM vendors WHERE id = ?', (vendor_id,))
-        vendor = cursor.fetchone()
-        if vendor:
-            return ids.Vendor(vendor[0], vendor[1])
-        else:
-            return
+        return _search_vendor_impl(con, vendor_id)
 
     except Exception as e:
         print(f'An error occurred:\n{e}')
         return
 
 
-def search_devices(con, device_id):
-    """
-    Search for devices by ID.
-
-    Args:
-        con: A sqlite3 connection object.
-        device_id: The device ID to search for.
-
-    Returns:
-        A list of Device objects if devices are found, None otherwise.
-    """
-    try:
-        cursor = con.cursor()
-        cursor.execute('SELECT * FROM devices WHERE id = ?', (device_id,))
-        devices = cursor.fetchall()
-        if devices:
-            return [ids.Device(device[0], device[1], device[2]) for device in devices]
-        else:
-            return
-    except Exception as e:
-        print(f'An error occurred:\n{e}')
+# Memoized per (connection, ID): repeated interactive lookups of popular
+# vendors hit the cache instead of the database. Safe to share because
+# Vendor/Device are immutable namedtuples and the tables only change via
+# -u, which runs in its own process invocation.
+@functools.lru_cache(maxsize=4096)
+def _search_vendor_impl(con, vendor_id):
+    vendor = con.execute('SELECT * FROM vendors WHERE id = ?', (vendor_id,)).fetchone()
+    if vendor:
+        return ids.Vendor(vendor[0], vendor[1])
+    else:
         return
 
 
@@ -144,50 +214,54 @@ def search_device(con, device_id, vendor_id=None):
 
     Args:
         con: A sqlite3 connection object.
-        device_id: The device ID to search for.
+        device_id: The device ID to search for, as a normalized integer
+            (see _norm).
         vendor_id: The vendor ID to search for. Optional.
 
     Returns:
         A Device object if the device is found, None otherwise.
     """
     try:
-        cursor = con.cursor()
-        if not vendor_id is None:
-            cursor.execute('SELECT * FROM devices WHERE id = ? AND vendor = ?', (device_id, vendor_id))
-        else:
-            cursor.execute('SELECT * FROM devices WHERE id = ?', (device_id,))
-
-        device = cursor.fetchone()
+        return _search_device_impl(con, device_id, vendor_id)
 
-        if device:
-            return ids.Device(device[0], device[1], device[2])
-        else:
-            return
-                
     except Exception as e:
         print(f'An error occurred:\n{e}')
         return
 
 
+@functools.lru_cache(maxsize=4096)
+def _search_device_impl(con, device_id, vendor_id):
+    if not vendor_id is None:
+        device = con.execute('SELECT * FROM devices WHERE id = ? AND vendor = ?',
+                             (device_id, vendor_id)).fetchone()
+    else:
+        device = con.execute('SELECT * FROM devices WHERE id = ?', (device_id,)).fetchone()
+
+    if device:
+        return ids.Device(device[0], device[1], device[2])
+    else:
+        return
+
+
 def reverse_device_search(con, vendor_id, device_name=None):
     """
     Perform a reverse device search for a vendor.
     
     Args:
         con: A sqlite3 connection object.
-        vendor_id: The vendor ID to search for.
+        vendor_id: The vendor ID to search for, as a normalized integer
+            (see _norm).
         device_name: The device name to search for. Optional.
 
     Returns:
         A list of Device objects if devices are found, None otherwise.
     """
     try:
-        cursor = con.cursor()
         if not device_name is None:
-            cursor.execute('SELECT * FROM devices WHERE name = ? AND vendor = ?', (device_name, vendor_id))
+            devices = con.execute('SELECT * FROM devices WHERE name = ? AND vendor = ?',
+                                  (device_name, vendor_id)).fetchall()
         else:
-            cursor.execute('SELECT * FROM devices WHERE vendor = ?', (vendor_id,))
-        devices = cursor.fetchall()
+            devices = con.execute('SELECT * FROM devices WHERE vendor = ?', (vendor_id,)).fetchall()
         if devices:
             return [ids.Device(device[0], device[1], device[2]) for device in devices]
         else:
@@ -222,28 +296,34 @@ def search_complete(con, vendor_id, device_id):
 # Search Functions
 def vendor_only(con, vendor_id):
     print('\nDatabase Reverse Device Search:')
+    vendor_id = _norm(vendor_id)
     devices = reverse_device_search(con, vendor_id)
     vendor = search_vendor(con, vendor_id)
-    print(f'\n{vendor.id} {vendor.name:100}')
+    print(f'\n{vendor.id:04x} {vendor.name:100}')
     for device in devices:
-        print(f'\t{device.id} {device.name}')
+        print(f'\t{device.id:04x} {device.name}')
 
 
 def device_only(con, device_id):
     print('\nDatabase Device Search:')
-    devices = search_devices(con, device_id)
-    for device in devices:
-        vendor = search_vendor(con, device.vendor)
-        if vendor:
-            print(f'\n{vendor.id} {vendor.name}\n\t{device.id} {device.name}')
+    device_id = _norm(device_id)
+    # One join instead of a device query plus a vendor query per match
+    rows = con.execute('SELECT d.id, d.name, v.id, v.name FROM devices d '
+                       'LEFT JOIN vendors v ON v.id = d.vendor WHERE d.id = ?',
+                       (device_id,)).fetchall()
+    if not rows:
+        raise LookupError(f'Device {device_id:04x} not found')
+    for did, dname, vid, vname in rows:
+        if vname:
+            print(f'\n{vid:04x} {vname}\n\t{did:04x} {dname}')
         else:
-            print(f'\nUnknown Vendor\n\t{device.id} {device.name}')
+            print(f'\nUnknown Vendor\n\t{did:04x} {dname}')
 
 
 def complete(con, vendor_id, device_id):
     print('\nDatabase Complete Search:')
-    vendor, device = search_complete(con, vendor_id, device_id)
-    print(f'\n{vendor.id} {vendor.name}\n\t{device.id} {device.name}')
+    vendor, device = search_complete(con, _norm(vendor_id), _norm(device_id))
+    print(f'\n{vendor.id:04x} {vendor.name}\n\t{device.id:04x} {device.name}')
 
 
 def interactive_mode(con):
@@ -297,26 +377,7 @@ def main(con):
         None
     """
     try:
-        parser = argparse.ArgumentParser(description='USB Lookup Tool')
-        parser.add_argument('-u', action='store_true', 
-                            help='Update the database with the latest vendor and device information. Usage: python usb-lookup.py -u')
-        parser.add_argument('-v', metavar='vendor_id', 
-                            help='Perform a reverse search in the database using a vendor id. '
-                                'This will return the devices associated with the provided vendor. '
-                                'Usage: python usb-lookup.py -v "Vendor ID"')
-        parser.add_argument('-d', metavar='device_id', 
-                            help='Search the database for a device using its ID. '
-                                'This will return the name and vendor associated with the provided ID. '
-                                'Usage: python usb-lookup.py -d "Device ID"')
-        parser.add_argument('-c', nargs=2, metavar=('vendor_id', 'device_id'), 
-                            help='Perform a complete search in the database using a vendor ID and device ID. '
-                                'This will return the names associated with the provided IDs. '
-                                'Usage: python usb-lookup.py -c "Vendor ID" "Device ID"')
-        parser.add_argument('-i', action='store_true', 
-                            help='Enter interactive mode. In this mode, the program will prompt you for input '
-                                'and perform searches based on your responses. '
-                                'Usage: python usb-lookup.py -i')
-        args = parser.parse_args()
+        args = _PARSER.parse_args()
 
         if args.u:
             print('\nUpdating Database...')
@@ -341,7 +402,7 @@ def main(con):
         elif args.i:
             interactive_mode(con)
         else:
-            parser.print_help()
+            _PARSER.print_help()
             return
 
 
@@ -357,7 +418,15 @@ def main(con):
 
 # Run program
 if __name__ == "__main__":
-    con = sql.connect(IDS_DB)
+    # Seed a missing database from the bundled snapshot before opening
+    # the connection, so check_db only hits the network when there is no
+    # snapshot to restore
+    if not os.path.exists(IDS_DB):
+        restore_db()
+
+    # isolation_level=None leaves transaction control to the explicit
+    # BEGIN/COMMIT in ids.update_db
+    con = sql.connect(IDS_DB, isolation_level=None)
     check_db(con)
     clear_screen()
     main(con)